@@ -1 +1,24 @@
-from .upload_validator import UploadValidator
\ No newline at end of file
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .upload_validator import UploadValidator
+
+__all__ = ["UploadValidator"]
+
+# submodules imported by the package before UploadValidator became lazy
+_SUBMODULES = ["upload_validator", "errors", "gene_mapping"]
+
+
+def __getattr__(name: str):
+    # import UploadValidator lazily, so the CLI doesn't pay for pandas import on --help
+    if name == "UploadValidator":
+        from .upload_validator import UploadValidator
+        return UploadValidator
+    if name in _SUBMODULES:
+        return import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_SUBMODULES))
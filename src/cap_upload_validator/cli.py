@@ -1,6 +1,3 @@
-from .upload_validator import UploadValidator
-from .errors import CapException
-
 from sys import stderr
 import argparse
 
@@ -27,7 +24,11 @@ def validate():
     parser.add_argument("adata_path", type=str, help="Path to the AnnData h5ad file.")
     args = parser.parse_args()
     adata_path = args.adata_path
-    
+
+    # heavy imports are done after parsing arguments to keep --help fast
+    from .upload_validator import UploadValidator
+    from .errors import CapException
+
     try:
         uv = UploadValidator(adata_path=adata_path)
         uv.validate()
@@ -1,7 +1,7 @@
 from typing import List
 
 
-class CapException(BaseException):
+class CapException(Exception):
     name = "Unknown"
     message = "Useless CAP exception"
 
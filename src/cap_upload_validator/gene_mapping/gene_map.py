@@ -1,7 +1,13 @@
 from dataclasses import dataclass
 import pandas as pd
 from pathlib import Path
-from typing import Union
+import os
+import tempfile
+from typing import Union, Tuple
+from functools import lru_cache
+import logging
+
+logger = logging.getLogger(__name__)
 
 HERE = Path(__file__).parent
 HUMAN_GENE_MAP_PATH = HERE / "data/homo_sapiens.csv"
@@ -61,6 +67,66 @@ def ontology_id_to_organism(ont_id_str: str) -> Organism:
     return UnsupportedOrganism
 
 
+def _read_gene_map(fp: Union[str, Path]) -> pd.DataFrame:
+    """
+    Reads the gene map CSV file. The parsed table is cached in the pickle file
+    next to the CSV, so the next reads skip the slow CSV parsing.
+    """
+    fp = Path(fp)
+    cache_fp = fp.with_suffix(".pkl")
+    csv_stat = fp.stat()
+    # the cache is valid only for the exact CSV it was built from, mtime alone could be older for new CSV
+    csv_key = (csv_stat.st_size, csv_stat.st_mtime_ns)
+    try:
+        cache = pd.read_pickle(cache_fp)
+        if cache["csv_key"] == csv_key:
+            return cache["data_frame"]
+        logger.debug(f"Gene map cache {cache_fp} is outdated!")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # e.g. the pickle was written by the incompatible pandas version
+        logger.debug(f"Failed to read gene map cache {cache_fp}: {e}")
+
+    df = pd.read_csv(fp, sep=',', header=0)
+    tmp_fp = None
+    try:
+        # write to the temp file and move it in place, so the concurrent readers never see a partial pickle
+        fd, tmp_fp = tempfile.mkstemp(dir=cache_fp.parent, prefix=cache_fp.name, suffix=".tmp")
+        os.close(fd)
+        pd.to_pickle({"csv_key": csv_key, "data_frame": df}, tmp_fp)
+        # mkstemp creates the file with 0600, let the other users of the shared install read it
+        os.chmod(tmp_fp, 0o644)
+        os.replace(tmp_fp, cache_fp)
+    except OSError as e:
+        # the package directory could be read-only
+        logger.debug(f"Failed to write gene map cache {cache_fp}: {e}")
+        if tmp_fp is not None and os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+    return df
+
+
+def _set_index_col(df: pd.DataFrame, index_col) -> pd.DataFrame:
+    """Sets the index as pd.read_csv(index_col=...) does, column positions or names are accepted."""
+    if index_col is None or index_col is False:
+        return df
+    cols = index_col if isinstance(index_col, (list, tuple)) else [index_col]
+    keys = [df.columns[c] if isinstance(c, int) else c for c in cols]
+    return df.set_index(keys)
+
+
+@lru_cache(maxsize=4)
+def _load_gene_frame(gene_map_path: Path) -> Tuple[pd.DataFrame, pd.Index]:
+    """
+    Loads the gene map once per process.
+    Returns the gene map and the index of its ENSEMBL ids.
+    The index hash table is built on the first lookup and reused by the next ones.
+    """
+    df = _read_gene_map(gene_map_path)
+    # own copy of ids, so the index values can't diverge from its hash table
+    return df, pd.Index(df['ENSEMBL_gene'].to_numpy(copy=True)).drop_duplicates()
+
+
 class GeneMap:
 
     @staticmethod
@@ -78,13 +144,28 @@ class GeneMap:
             organisms = [organisms]
         
         dfs = []
+        read_paths = set()
         for organism in organisms:
             if issubclass(organism, Organism):
                 fp = organism.gene_map_path
-                if fp is not None:
-                    df = pd.read_csv(fp, sep=',', header=0, index_col=index_col)  # index=0 to make Ensemble ids index
+                # e.g. MultiSpecies shares the gene map with HomoSapiens, add it once
+                if fp is not None and fp not in read_paths:
+                    read_paths.add(fp)
+                    df, _ = _load_gene_frame(fp)
+                    # copy to keep the cached gene map intact from changes by the caller
+                    df = _set_index_col(df.copy(), index_col)  # index_col=0 to make Ensemble ids index
                     dfs.append(df)
         if len(dfs) > 0:
             return pd.concat(dfs, axis=0)
         else:
             return None
+
+    @staticmethod
+    def ensembl_ids(organism: Union[str, Organism]) -> pd.Index:
+        """Returns the unique ENSEMBL gene ids from the gene map of given organism."""
+        if isinstance(organism, str):
+            organism = str_to_organism(organism)
+        if organism.gene_map_path is None:
+            return pd.Index([], dtype=object)
+        _, ids = _load_gene_frame(organism.gene_map_path)
+        return ids
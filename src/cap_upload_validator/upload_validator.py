@@ -1,9 +1,9 @@
 import pandas as pd
 import numpy as np
 from scipy.sparse import issparse
-from cap_anndata import CapAnnData, read_h5ad
+from cap_anndata import CapAnnData, CapAnnDataDF, read_h5ad
 import logging
-from h5py import Dataset, Group
+from h5py import Dataset, Group, File
 
 from .gene_mapping import (
     GeneMap,
@@ -24,15 +24,24 @@ from .errors import (
     AnnDataNoneInGeneralMetadata,
     CSCMatrixInX,
 )
-from typing import Optional
+from typing import Optional, List
+
+try:
+    from anndata.io import read_elem
+except ImportError:
+    # anndata < 0.11
+    from anndata.experimental import read_elem
 
 logger = logging.getLogger(__name__)
 
 MAX_OBS_ROWS_TO_CHECK = 100
+X_CHECK_BLOCK_SIZE = 2 ** 16
 EMBEDDING_PREFIX = "X_"
 ORGANISM_COLUMN = "organism"
 ORGANISM_ONT_ID_COLUMN = f"{ORGANISM_COLUMN}_ontology_term_id"
 GENERAL_METADATA = ["assay", "disease", ORGANISM_COLUMN, "tissue"]
+GENERAL_METADATA_ONT_ID = [f"{col}_ontology_term_id" for col in GENERAL_METADATA]
+KNOWN_ORGANISMS = frozenset(ko.name for ko in [HomoSapiens, MusMusculus])  # Only Human and Mouse supported this moment
 
 class UploadValidator:
 
@@ -64,10 +73,8 @@ class UploadValidator:
             raise BadAnnDataFile
         
         with read_h5ad(self._adata_path, edit=False) as cap_adata:
-            cap_adata.read_obs(columns=GENERAL_METADATA)  # TODO: read all columns?
-            cap_adata.read_var(columns=[])
-            if cap_adata.raw is not None:
-                cap_adata.raw.read_var(columns=[])
+            # read all the checked columns at once, the missing ones are skipped
+            self._read_obs_columns(cap_adata, columns=GENERAL_METADATA + GENERAL_METADATA_ONT_ID)
 
             self._validate_x_and_raw_x_formats(cap_adata)
             self._check_X(cap_adata)
@@ -91,10 +98,9 @@ class UploadValidator:
         
         missing_genes = None
         with read_h5ad(self._adata_path, edit=False) as cap_adata:
-            cap_adata.read_obs(columns=GENERAL_METADATA)  # TODO: read all columns?
+            # cap_adata.obs setter used by _read_obs_columns requires X, which is optional here
+            cap_adata.read_obs(columns=[ORGANISM_COLUMN, ORGANISM_ONT_ID_COLUMN])
             cap_adata.read_var()
-            if cap_adata.raw is not None:
-                cap_adata.raw.read_var()
             
             missing_genes_mask = self._check_var_index(cap_adata=cap_adata)
             if missing_genes_mask is not None:
@@ -103,6 +109,28 @@ class UploadValidator:
         return missing_genes
         
 
+    @staticmethod
+    def _read_obs_columns(cap_adata: CapAnnData, columns: List[str]) -> None:
+        """
+        Reads given obs columns to cap_adata.obs, the missing ones are skipped.
+        Unlike cap_adata.read_obs, the obs index is not read (twice) since the validator doesn't use it.
+        """
+        group = cap_adata.file["obs"]
+        column_order = group.attrs["column-order"]
+        data = {col: read_elem(group[col]) for col in columns if col in column_order}
+        n_obs = group[group.attrs["_index"]].shape[0]  # metadata only, the index itself is not read
+        df = pd.DataFrame(data, index=pd.RangeIndex(n_obs))
+        cap_adata.obs = CapAnnDataDF.from_df(df, column_order=column_order)
+
+    @staticmethod
+    def _add_obs_column(cap_adata: CapAnnData, column: str) -> None:
+        """
+        Reads the obs column and adds it to cap_adata.obs by position.
+        cap_adata.read_obs is not used as it aligns the column on the obs index,
+        which is the RangeIndex after _read_obs_columns.
+        """
+        cap_adata.obs[column] = read_elem(cap_adata.file["obs"][column])
+
     def _check_X(self, cap_adata: CapAnnData) -> None:
         logger.debug("Begin checking X")
         X = cap_adata.raw.X if cap_adata.raw is not None else cap_adata.X
@@ -111,12 +139,22 @@ class UploadValidator:
         logger.debug("Finished checking X!")
 
     @staticmethod
-    def has_only_integers(arr: np.ndarray) -> bool:
-        return np.all((arr - arr.astype(int)) == 0)
-
-    @staticmethod
-    def has_negative_values(arr: np.ndarray) -> bool:
-        return np.any(arr < 0)
+    def has_only_positive_integers(arr: np.ndarray) -> bool:
+        arr = np.asarray(arr).ravel()
+        is_integer_dtype = arr.dtype.kind in "biu"
+        # scan the array by blocks to stop on the first block with a bad value
+        for start in range(0, arr.size, X_CHECK_BLOCK_SIZE):
+            block = arr[start:start + X_CHECK_BLOCK_SIZE]
+            if block.min() < 0:
+                return False
+            if is_integer_dtype:
+                continue
+            if not np.isfinite(block.max()):
+                # NaN or inf
+                return False
+            if not np.array_equal(block, np.floor(block)):
+                return False
+        return True
 
     def _check_is_positive_integers(self, cap_adata: CapAnnData) -> bool:
         n_cells = cap_adata.shape[0]
@@ -127,13 +165,30 @@ class UploadValidator:
         is_sparse = issparse(X[0])
         logger.debug(f"Checking elements in X to be positive integers, with n_cells = {n_cells}, max_rows = {max_rows}, is_sparse = {is_sparse}!")
 
-        arr = X[0:max_rows].data if is_sparse else X[0:max_rows]
-        if not self.has_only_integers(arr) or self.has_negative_values(arr):
+        if is_sparse and X.format == "csr":
+            arr = self._csr_head_data(X, max_rows)
+        elif is_sparse:
+            arr = X[0:max_rows].data
+        else:
+            arr = X[0:max_rows]
+        if not self.has_only_positive_integers(arr):
             logger.debug(f"There are not positive integers found in X!")
             return False
 
         return True
 
+    @staticmethod
+    def _csr_head_data(X, n_rows: int) -> np.ndarray:
+        """
+        Returns non zero values of the first n_rows of CSR matrix.
+        They are the head of the data array, so the matrix is not sliced.
+        """
+        if issparse(X):
+            return X.data[:X.indptr[n_rows]]
+        # backed CSR dataset, read only the required part of data from the file
+        end = int(X.group["indptr"][n_rows])
+        return X.group["data"][:end]
+
     def _check_obsm(self, cap_adata: CapAnnData) -> None:
         logger.debug("Begin checking obsm")
         if self._has_embeddings(cap_adata) is False:
@@ -141,25 +196,27 @@ class UploadValidator:
         logger.debug("Finished checking obsm!")
 
     def _has_embeddings(self, cap_adata: CapAnnData) -> bool:
-        if cap_adata.obsm is None:
+        # cap_adata.obsm is not used as it reads dataframes stored in obsm while linking
+        if "obsm" not in cap_adata.file:
             logger.debug("Obsm is not found in anndata!")
             return False
         
         n_cells = cap_adata.shape[0]
+        obsm = cap_adata.file["obsm"]
 
-        for field in cap_adata.obsm_keys():
+        for field in obsm.keys():
             if field.startswith(EMBEDDING_PREFIX):
-                entity = cap_adata.obsm[field]
+                entity = obsm[field]
                 if isinstance(entity, Dataset) and entity.shape == (n_cells, 2):
-                    # looking for dense matrix of N x 2 shape 
+                    # looking for dense matrix of N x 2 shape, the shape is read from metadata only
                     return True
 
-        logger.debug(f"Embeddings not found in obsm_keys = {cap_adata.obsm_keys()}!")
+        logger.debug(f"Embeddings not found in obsm keys = {list(obsm.keys())}!")
         return False
 
     def _check_obs(self, cap_adata: CapAnnData) -> None:
         logger.debug("Start checking obs")
-        obs_keys = cap_adata.obs_keys()
+        obs_keys = frozenset(cap_adata.obs_keys())
         logger.debug(f"Checking obs_columns = {obs_keys} for required {GENERAL_METADATA}!")
         
         if cap_adata.obs is None or not obs_keys:
@@ -167,8 +224,7 @@ class UploadValidator:
             self._multi_exception.append(AnnDataMissingObsColumns())
             return
 
-        for col in GENERAL_METADATA:
-            ont_id_col = f"{col}_ontology_term_id"
+        for col, ont_id_col in zip(GENERAL_METADATA, GENERAL_METADATA_ONT_ID):
             col_in_obs = col in obs_keys
             ont_id_col_in_obs = ont_id_col in obs_keys
 
@@ -183,7 +239,8 @@ class UploadValidator:
                         self._multi_exception.append(AnnDataNoneInGeneralMetadata(f"{col} column contains None or empty values in .obs!"))
                         return
                 if ont_id_col_in_obs:
-                    cap_adata.read_obs([ont_id_col])
+                    if ont_id_col not in cap_adata.obs.columns:
+                        self._add_obs_column(cap_adata, ont_id_col)
                     if not self._check_df_col_for_none(cap_adata.obs[ont_id_col]):
                         logger.debug(f"Column {ont_id_col} contains None or empty values in .obs!")
                         self._multi_exception.append(AnnDataNoneInGeneralMetadata(f"{ont_id_col} column contains None or empty values in .obs!"))
@@ -192,12 +249,18 @@ class UploadValidator:
 
     @staticmethod
     def _check_df_col_for_none(series: pd.Series) -> bool:
-        series = series.replace(r'^\s*$', np.nan, regex=True)
-        return pd.notna(series).all()
+        if series.isna().any():
+            return False
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # check the categories only and then look for the codes of blank ones
+            categories = series.cat.categories
+            blank_codes = np.flatnonzero(categories.astype(str).str.strip() == "")
+            return not (blank_codes.size and series.cat.codes.isin(blank_codes).any())
+        return not (series.astype(str).str.strip() == "").any()
 
     def _check_var_index(self, cap_adata: CapAnnData) -> Optional[pd.Series]:
         logger.debug("Start checking var index...")
-        index = cap_adata.var.index
+        index = self._read_df_index(cap_adata.file, "var")
         clean_index = self._remove_gene_version(index)
         self._ensembl_ids = clean_index
 
@@ -207,38 +270,33 @@ class UploadValidator:
             return 
 
         # Check if the var.index is a subset of raw.var.index
-        if cap_adata.raw is not None and cap_adata.raw.var is not None:
+        if cap_adata.raw is not None and "raw/var" in cap_adata.file:
             logger.debug("As of raw exists, checking that var.index is a subset of raw.var.index!")
-            if not index.isin(cap_adata.raw.var.index).all():
+            raw_index = self._read_df_index(cap_adata.file, "raw/var")
+            if not set(raw_index).issuperset(index):
                 self._multi_exception.append(AnnDataNonStandardVarError())
                 return
 
         # Check the number of organisms in the dataset
-        known_organisms = [HomoSapiens, MusMusculus] # Only Human and Mouse supported this moment
-        known_organisms_values = {ko.name for ko in known_organisms}
-        obs_keys = cap_adata.obs_keys()
+        obs_keys = frozenset(cap_adata.obs_keys())
         if ORGANISM_COLUMN in obs_keys:
-            dataset_organisms = cap_adata.obs[ORGANISM_COLUMN].unique().tolist()
-            if "" in dataset_organisms:
-                dataset_organisms.remove("")
+            dataset_organisms = self._unique_values(cap_adata.obs[ORGANISM_COLUMN])
             dataset_organisms = list(map(str_to_organism, dataset_organisms))
         elif ORGANISM_ONT_ID_COLUMN in obs_keys:
             if ORGANISM_ONT_ID_COLUMN not in cap_adata.obs.columns:
-                cap_adata.read_obs(columns=[ORGANISM_ONT_ID_COLUMN])
-            org_ont_ids = cap_adata.obs[ORGANISM_ONT_ID_COLUMN].unique().tolist()
-            if "" in org_ont_ids:
-                org_ont_ids.remove("")
+                self._add_obs_column(cap_adata, ORGANISM_ONT_ID_COLUMN)
+            org_ont_ids = self._unique_values(cap_adata.obs[ORGANISM_ONT_ID_COLUMN])
             dataset_organisms = list(map(ontology_id_to_organism, org_ont_ids))
         else:
             dataset_organisms = []
-        logger.debug(f"Organism(s) in dataset = {dataset_organisms}, known organisms = {known_organisms_values}")
+        logger.debug(f"Organism(s) in dataset = {dataset_organisms}, known organisms = {set(KNOWN_ORGANISMS)}")
        
         missing_genes_mask = None
         # Check ENSEMBL ids for supported organism
         if len(dataset_organisms) == 1:
             organism = dataset_organisms[0]
             self._organism = organism
-            if organism.name in known_organisms_values:
+            if organism.name in KNOWN_ORGANISMS:
                 logger.debug("There is the only known organisms in dataset, so we must check for Unsemble IDs in var.index!")
                 missing_genes_mask = self._validate_gene_ids(ens_ids=clean_index, organism=organism)
             else:
@@ -253,6 +311,25 @@ class UploadValidator:
         logger.debug("Finished checking var index!")
         return missing_genes_mask
     
+    @staticmethod
+    def _unique_values(series: pd.Series) -> list:
+        """
+        Returns unique non empty values of the series.
+        For categorical series only the categories in use are returned, NaN is skipped.
+        """
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.unique()
+            values = series.cat.categories[codes[codes >= 0]].tolist()
+        else:
+            values = series.unique().tolist()
+        return [v for v in values if v != ""]
+
+    @staticmethod
+    def _read_df_index(file: File, key: str) -> pd.Index:
+        """Reads only the index of the dataframe stored in file[key], the columns are skipped."""
+        group = file[key]
+        return pd.Index(read_elem(group[group.attrs["_index"]]))
+
     def _validate_gene_ids(
             self,
             ens_ids: pd.Series,
@@ -270,8 +347,9 @@ class UploadValidator:
             return
         
         # Check genes with gene maps
-        df = GeneMap.data_frame(organisms=organism)
-        missing_genes_mask = ~ens_ids.isin(df['ENSEMBL_gene'])
+        gene_ids = GeneMap.ensembl_ids(organism)
+        # get_indexer reuses the hash table of the cached gene ids index
+        missing_genes_mask = gene_ids.get_indexer(ens_ids) < 0
         if missing_genes_mask.any():
             # Gene names are non standard
             logger.debug("Gene names are not standard!")
@@ -286,9 +364,7 @@ class UploadValidator:
             ENSG0001.8 -> ENSG0001
             ENSG0001   -> ENSG0001
         """
-        clean_index = ensemble_ids.to_series().apply(lambda x: x.split(".")[0])
-        clean_index = pd.Index(clean_index)
-        return clean_index
+        return ensemble_ids.map(lambda x: x.partition(".")[0])
 
     def _is_csc(self, group_or_dataset) -> bool:
         """
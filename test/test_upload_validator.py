@@ -8,8 +8,10 @@ if version.parse(ad.__version__) >= version.parse("0.11.0"):
     ad.settings.allow_write_nullable_strings = True
 
 import scipy.sparse as sp
+import h5py
 from pathlib import Path
 import tempfile
+import os
 from cap_anndata import CapAnnDataDF, read_h5ad
 from contextlib import nullcontext
 
@@ -18,6 +20,8 @@ from cap_upload_validator.upload_validator import (
     GENERAL_METADATA,
     ORGANISM_COLUMN,
     ORGANISM_ONT_ID_COLUMN,
+    MAX_OBS_ROWS_TO_CHECK,
+    X_CHECK_BLOCK_SIZE,
 )
 from cap_upload_validator.gene_mapping import (
     GeneMap,
@@ -26,6 +30,7 @@ from cap_upload_validator.gene_mapping import (
     MultiSpecies,
     UnsupportedOrganism,
 )
+from cap_upload_validator.gene_mapping.gene_map import _read_gene_map, _load_gene_frame
 from cap_upload_validator.errors import (
     AnnDataMissingEmbeddings,
     AnnDataMissingObsColumns,
@@ -53,6 +58,12 @@ TMP_DIR = Path(tempfile.mkdtemp())
         [-3.0, 4.0, -5.0],
         [6.0, 7.0, 0.0]
     ])),
+    (True, np.zeros((3, 3))),
+    (False, np.array([
+        [0.0, 1.0, np.inf],
+        [3.0, 4.0, 5.0],
+        [6.0, np.nan, 0.0]
+    ])),
 ])
 @pytest.mark.parametrize("sparse", [True, False])
 def test_is_positive_integers(sparse, expected_with_data):
@@ -63,6 +74,29 @@ def test_is_positive_integers(sparse, expected_with_data):
     assert v._check_is_positive_integers(adata) == expected, "Incorrect X matrix validation!"
 
 
+@pytest.mark.parametrize("bad_value", [0.5, -1, np.nan])
+def test_has_only_positive_integers_in_last_block(bad_value):
+    arr = np.ones(2 * X_CHECK_BLOCK_SIZE + 1, dtype=np.float32)
+    assert UploadValidator.has_only_positive_integers(arr)
+    arr[-1] = bad_value
+    assert not UploadValidator.has_only_positive_integers(arr)
+
+
+@pytest.mark.parametrize("bad_row, expected", [
+    (MAX_OBS_ROWS_TO_CHECK - 1, False),
+    (MAX_OBS_ROWS_TO_CHECK, True),  # rows after MAX_OBS_ROWS_TO_CHECK are not checked
+])
+def test_is_positive_integers_backed_csr(tmp_path, bad_row, expected):
+    file_path = tmp_path / "test_backed_csr.h5ad"
+    X = np.ones((MAX_OBS_ROWS_TO_CHECK + 10, 3), dtype=np.float32)
+    X[bad_row, 1] = 0.5
+    ad.AnnData(X=sp.csr_matrix(X)).write_h5ad(file_path)
+
+    with read_h5ad(file_path, edit=False) as cap_adata:
+        v = UploadValidator(adata_path=file_path)
+        assert v._check_is_positive_integers(cap_adata) == expected, "Incorrect X matrix validation!"
+
+
 def test_has_embeddings():
     file_path = TMP_DIR / "test_has_embeddings.h5ad"
     emb_name = "X_test"
@@ -71,7 +105,7 @@ def test_has_embeddings():
     adata.obsm[emb_name] = np.ones(shape=(adata.shape[0], 2))
     adata.write_h5ad(file_path)
 
-    with read_h5ad(file_path, edit=False) as cap_adata:
+    with read_h5ad(file_path, edit=True) as cap_adata:
         v = UploadValidator(adata_path=file_path)
         v._multi_exception.raise_on_append = True
         try:
@@ -79,7 +113,9 @@ def test_has_embeddings():
         except:
             assert False, "Must be embeddings in file!"
 
+        # embeddings are checked in the file, so remove it there
         del cap_adata.obsm[emb_name]
+        cap_adata.overwrite(fields=["obsm"])
 
         try:
             v._check_obsm(cap_adata)
@@ -121,6 +157,56 @@ def test_obs():
         check_obs(cap_adata, False)
 
 
+def test_read_obs_columns(tmp_path):
+    file_path = tmp_path / "test_read_obs_columns.h5ad"
+    adata = ad.AnnData(X=np.eye(10))
+    adata.obs[ORGANISM_COLUMN] = pd.Categorical([HomoSapiens.name] * 10)
+    adata.obs["other"] = 1
+    adata.write_h5ad(file_path)
+
+    with read_h5ad(file_path, edit=False) as cap_adata:
+        UploadValidator._read_obs_columns(cap_adata, columns=[ORGANISM_COLUMN, ORGANISM_ONT_ID_COLUMN])
+        assert cap_adata.obs_keys() == [ORGANISM_COLUMN, "other"]
+        assert cap_adata.obs.columns.tolist() == [ORGANISM_COLUMN]
+        assert (cap_adata.obs[ORGANISM_COLUMN] == HomoSapiens.name).all()
+
+
+def test_var_index_organism_ontology_id_not_prefetched(tmp_path):
+    file_path = tmp_path / "test_organism_ont_id.h5ad"
+    gene_map = GeneMap.data_frame(HomoSapiens)
+    adata = ad.AnnData(X=np.eye(5))
+    adata.obs[ORGANISM_ONT_ID_COLUMN] = pd.Categorical([HomoSapiens.ontology_id] * 5)
+    adata.obs["other"] = "x"
+    adata.var.index = gene_map.ENSEMBL_gene[:5]
+    adata.write_h5ad(file_path)
+
+    v = UploadValidator(file_path)
+    v._multi_exception.raise_on_append = True
+    with read_h5ad(file_path, edit=False) as cap_adata:
+        UploadValidator._read_obs_columns(cap_adata, columns=["other"])
+        v._check_var_index(cap_adata)
+        assert (cap_adata.obs[ORGANISM_ONT_ID_COLUMN] == HomoSapiens.ontology_id).all()
+    assert v.organism is HomoSapiens
+
+
+@pytest.mark.parametrize("valid_genes", [True, False])
+def test_find_missing_genes_without_x(tmp_path, valid_genes):
+    file_path = tmp_path / "test_without_x.h5ad"
+    gene_map = GeneMap.data_frame(HomoSapiens)
+    genes = gene_map.ENSEMBL_gene[:4].tolist()
+    if not valid_genes:
+        genes[-1] = "not_a_gene"
+    obs = pd.DataFrame({ORGANISM_COLUMN: [HomoSapiens.name] * 3}, index=["a", "b", "c"])
+    adata = ad.AnnData(X=None, obs=obs, var=pd.DataFrame(index=genes))
+    adata.write_h5ad(file_path)
+
+    missing_genes = UploadValidator(file_path).find_missing_genes()
+    if valid_genes:
+        assert missing_genes is None
+    else:
+        assert missing_genes.index.tolist() == ["not_a_gene"]
+
+
 def test_var_index():    
     v = UploadValidator(None)
     gene_map = GeneMap.data_frame()
@@ -237,9 +323,10 @@ def test_df_in_obsm():
             v._check_obsm(adata)
 
 
+@pytest.mark.parametrize("prefetch", ["read_obs", "_read_obs_columns"])
 @pytest.mark.parametrize("with_none", [True, False])
 @pytest.mark.parametrize("names_provided", [True, False])
-def test_ontology_id_instead_general_metadata(names_provided, with_none):
+def test_ontology_id_instead_general_metadata(names_provided, with_none, prefetch):
     file_path = TMP_DIR / "test_ontology_id_instead_general_metadata.h5ad"
     adata = ad.AnnData(X=np.eye(10))
 
@@ -266,10 +353,26 @@ def test_ontology_id_instead_general_metadata(names_provided, with_none):
     
     with read_h5ad(file_path) as adata:
         with context:
-            adata.read_obs(GENERAL_METADATA)
+            # ontology id columns are read by _check_obs
+            if prefetch == "read_obs":
+                adata.read_obs(GENERAL_METADATA)
+            else:
+                UploadValidator._read_obs_columns(adata, columns=GENERAL_METADATA)
             v._check_obs(adata)
 
 
+@pytest.mark.parametrize("expected, series", [
+    (True, pd.Series(["a", "b"])),
+    (False, pd.Series(["a", " "])),
+    (False, pd.Series(["a", None])),
+    (True, pd.Series(pd.Categorical(["a", "b"], categories=["a", "b", " "]))),  # unused blank category
+    (False, pd.Series(pd.Categorical(["a", "\t"]))),
+    (False, pd.Series(pd.Categorical(["a", None]))),
+])
+def test_check_df_col_for_none(expected, series):
+    assert UploadValidator._check_df_col_for_none(series) == expected
+
+
 def write_adata_with_matrix(path, X, raw_X=None):
     adata = ad.AnnData(X=X)
 
@@ -340,3 +443,129 @@ def test_dense_and_csr_pass(tmp_path):
 
     with read_h5ad(p, edit=False) as cap_adata:
         v._validate_x_and_raw_x_formats(cap_adata) # should not raise
+
+
+def test_gene_map_pickle_cache(tmp_path):
+    csv_path = tmp_path / "gene_map.csv"
+    pd.DataFrame({
+        "ENSEMBL_gene": ["ENSG0001", "ENSG0002"],
+        "HGNC_symbol": ["A", "B"],
+    }).to_csv(csv_path, index=False)
+    cache_path = csv_path.with_suffix(".pkl")
+
+    df = _read_gene_map(csv_path)
+    assert cache_path.exists(), "Gene map cache must be created!"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["gene_map.csv", "gene_map.pkl"], "Temp file is left!"
+    assert cache_path.stat().st_mode & 0o777 == 0o644
+
+    cached_df = _read_gene_map(csv_path)
+    pd.testing.assert_frame_equal(df, cached_df)
+
+
+def test_gene_map_pickle_cache_outdated(tmp_path):
+    csv_path = tmp_path / "gene_map.csv"
+    pd.DataFrame({"ENSEMBL_gene": ["ENSG0001"]}).to_csv(csv_path, index=False)
+    _read_gene_map(csv_path)
+    cache_mtime = csv_path.with_suffix(".pkl").stat().st_mtime
+
+    # new CSV looking older than the cache, e.g. installed with preserved mtime
+    new_df = pd.DataFrame({"ENSEMBL_gene": ["ENSG0001", "ENSG0002"]})
+    new_df.to_csv(csv_path, index=False)
+    os.utime(csv_path, (cache_mtime - 100, cache_mtime - 100))
+
+    pd.testing.assert_frame_equal(_read_gene_map(csv_path), new_df)
+    pd.testing.assert_frame_equal(_read_gene_map(csv_path), new_df)
+
+
+@pytest.mark.parametrize("index_col", [None, False, 0, "ENSEMBL_gene", [0], [0, 1]])
+def test_gene_map_index_col(index_col):
+    expected = pd.read_csv(HomoSapiens.gene_map_path, index_col=index_col)
+    pd.testing.assert_frame_equal(GeneMap.data_frame(HomoSapiens, index_col=index_col), expected)
+
+
+def test_gene_map_ensembl_ids():
+    human_ids = GeneMap.ensembl_ids(HomoSapiens)
+    assert human_ids is GeneMap.ensembl_ids(HomoSapiens.name), "Gene ids must be loaded once!"
+    assert human_ids.equals(pd.Index(GeneMap.data_frame(HomoSapiens).ENSEMBL_gene))
+    assert GeneMap.ensembl_ids(MultiSpecies) is human_ids
+    assert GeneMap.ensembl_ids(UnsupportedOrganism).empty
+
+
+def test_gene_map_data_frame_is_copy():
+    gene_id = GeneMap.data_frame(HomoSapiens).loc[0, "ENSEMBL_gene"]
+    df = GeneMap.data_frame(HomoSapiens)
+    df.loc[0, "ENSEMBL_gene"] = "MUTATED"
+    df["ENSEMBL_gene"].values[1] = "MUTATED"
+    assert GeneMap.data_frame(HomoSapiens).loc[0, "ENSEMBL_gene"] == gene_id
+    assert "MUTATED" not in GeneMap.data_frame(HomoSapiens)["ENSEMBL_gene"].values
+
+
+def test_gene_map_ensembl_ids_own_memory():
+    cached_df, ids = _load_gene_frame(HomoSapiens.gene_map_path)
+    assert not np.shares_memory(ids.values, cached_df["ENSEMBL_gene"].values)
+
+
+def test_gene_map_data_frame_shared_map():
+    human_df = GeneMap.data_frame(HomoSapiens)
+    assert GeneMap.data_frame([HomoSapiens, MultiSpecies]).shape == human_df.shape
+    assert GeneMap.data_frame([HomoSapiens, MusMusculus]).shape[0] > human_df.shape[0]
+
+
+def write_fixed_length_index(file_path, key):
+    """Rewrites the index of the dataframe at file[key] as fixed-length strings."""
+    with h5py.File(file_path, "r+") as f:
+        group = f[key]
+        index_key = group.attrs["_index"]
+        index = group[index_key]
+        attrs = dict(index.attrs)
+        values = index.asstr()[()].astype("S20")
+        del group[index_key]
+        group.create_dataset(index_key, data=values)
+        group[index_key].attrs.update(attrs)
+
+
+def test_var_index_fixed_length_strings(tmp_path):
+    file_path = tmp_path / "test_fixed_length_var.h5ad"
+    gene_map = GeneMap.data_frame(HomoSapiens)
+    adata = ad.AnnData(X=np.eye(5))
+    adata.obs[ORGANISM_COLUMN] = HomoSapiens.name
+    adata.var.index = [f"{g}.1" for g in gene_map.ENSEMBL_gene[:5]]
+    adata.write_h5ad(file_path)
+    write_fixed_length_index(file_path, "var")
+
+    v = UploadValidator(file_path)
+    v._multi_exception.raise_on_append = True
+    with read_h5ad(file_path, edit=False) as cap_adata:
+        UploadValidator._read_obs_columns(cap_adata, columns=[ORGANISM_COLUMN])
+        assert v._check_var_index(cap_adata) is None
+    assert v.ensembl_ids.tolist() == gene_map.ENSEMBL_gene[:5].tolist()
+
+
+@pytest.mark.parametrize("fixed_length_raw_index", [False, True])
+@pytest.mark.parametrize("var_in_raw", [True, False])
+def test_var_index_subset_of_raw(tmp_path, var_in_raw, fixed_length_raw_index):
+    file_path = tmp_path / "test_raw_var.h5ad"
+    adata = ad.AnnData(X=np.eye(5))
+    adata.var.index = [f"gene_{i}" for i in range(5)]
+    raw = ad.AnnData(X=np.eye(5))
+    raw.var.index = adata.var.index if var_in_raw else [f"raw_gene_{i}" for i in range(5)]
+    adata.raw = raw
+    adata.write_h5ad(file_path)
+    if fixed_length_raw_index:
+        write_fixed_length_index(file_path, "raw/var")
+
+    v = UploadValidator(file_path)
+    v._multi_exception.raise_on_append = True
+    context = nullcontext() if var_in_raw else pytest.raises(AnnDataNonStandardVarError)
+    with read_h5ad(file_path, edit=False) as cap_adata:
+        cap_adata.read_var()
+        with context:
+            v._check_var_index(cap_adata)
+
+
+def test_package_exports():
+    import cap_upload_validator
+
+    assert "UploadValidator" in dir(cap_upload_validator)
+    assert cap_upload_validator.UploadValidator is UploadValidator
+    assert cap_upload_validator.upload_validator.UploadValidator is UploadValidator